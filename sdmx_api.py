@@ -14,7 +14,10 @@ I hope it will work with other SDMX APIs too but it is not yet tested.
 import requests
 import logging as lg
 from urllib.parse import urljoin
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 
 from sdmx_response import SdmxResponse
 from string_utils import camel
@@ -33,6 +36,8 @@ class Filter(object):
     def __init__(self, dimensions):
         self.all_dims = dimensions
         self.ind_dims = [d for d in dimensions if not d in self.non_ind]
+        self._dim_sets = {True: frozenset(self.ind_dims), 
+                          False: frozenset(self.all_dims)}
     
     def dims(self, ind=True):
         if ind:
@@ -41,7 +46,7 @@ class Filter(object):
             return self.all_dims
         
     def is_dim(self, dim, ind=True):
-        return dim.upper() in self.dims(ind)
+        return dim.upper() in self._dim_sets[bool(ind)]
     
     #def is_complete(self, d):
     #    """ Test whether a dictionary represents a complete indicator """
@@ -50,14 +55,16 @@ class Filter(object):
     
     def extract_dims(self, d, ind=True):
         """ Extract the valid dimensions from a dictionary """
-        return {k.upper(): v for k, v in d.items() if self.is_dim(k, ind)}
+        return self.extract_dims_and_remainder(d, ind)[0]
     
     def extract_dims_and_remainder(self, d, ind=True):
+        dims = self._dim_sets[bool(ind)]
         r = {}
         remainder = {}
         for k, v in d.items():
-            if self.is_dim(k, ind):
-                r[k.upper()] = v
+            upper = k.upper()
+            if upper in dims:
+                r[upper] = v
             else:
                 remainder[k] = v
         return r, remainder
@@ -87,7 +94,8 @@ class Api(object):
     
     
     """
-    def __init__(self, base, subscription_key, dimensions=None):
+    def __init__(self, base, subscription_key, dimensions=None, 
+                 cache_name=None, cache_expiry=86400, memoize=False):
         self.base = base
         if base[-1] != "/":
             self.base += "/"
@@ -96,12 +104,19 @@ class Api(object):
             self.filter = Filter(dimensions)
         self.verification = True
         self.process_response = SdmxResponse
+        self.session = make_session(cache_name, cache_expiry)
+        # Successful responses by URL and parameters, if memoize is set
+        self._responses = {} if memoize else None
 
         
     def get(self, spec=None, params=None):
         """ Forms a URL from the filter specification and submits a request
         to the API using the specified parameters. Returns a message in json
-        format. """
+        format. 
+        
+        If the Api was created with memoize=True, repeating a query returns a
+        new response object built from the stored HTTP response, without 
+        contacting the server again. """
         if params is None:
             params = {}
         url = urljoin(self.base, self.filter.dict_to_key(spec, False))
@@ -109,7 +124,12 @@ class Api(object):
         params["format"] = "sdmx-json"
         params["subscription-key"] = self.subscription_key
         lg.info("Api.get \nurl:%s \nparams:%s", url, params)
-        response = requests.get(url, params=params, verify=self.verification)
+        memo_key = (url, tuple(sorted((k, str(v)) for k, v in params.items())))
+        if self._responses is not None and memo_key in self._responses:
+            return self.process_response(self._responses[memo_key])
+        response = self.session.get(url, params=params, verify=self.verification)
+        if self._responses is not None and response.ok:
+            self._responses[memo_key] = response
         return self.process_response(response)
     
     def query(self, **kwargs):
@@ -119,6 +139,32 @@ class Api(object):
         """
         spec, remainder = self.filter.extract_dims_and_remainder(kwargs, False)
         return self.get(spec, remainder)
+    
+    def query_many(self, queries, max_workers=8):
+        """ Submit several queries to the API at the same time. queries
+        is a list of dicts of keyword arguments for self.query. Returns a list 
+        of the responses in the same order.
+        
+        Useful when a single combined query would be too large, or would
+        over-query (see combine_queries).
+        """
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            return list(executor.map(lambda q: self.query(**q), queries))
+    
+    def query_chunked(self, chunk_by, values, chunk_size=10, max_workers=8, 
+                      **kwargs):
+        """ Split a query for many values of one parameter, e.g. 
+        chunk_by="ref_area" and a long list of countries, into queries for
+        at most chunk_size values each. These are submitted at the same time 
+        with query_many, and the list of responses is returned.
+        
+        This needs far fewer requests than one query per value, while 
+        keeping each response a manageable size.
+        """
+        values = list(values)
+        return self.query_many([{**kwargs, chunk_by: values[i:i + chunk_size]}
+                                for i in range(0, len(values), chunk_size)],
+                               max_workers=max_workers)
         
         
     def get_dimension_information(self, spec=None):
@@ -148,39 +194,71 @@ class Api(object):
                 for d in self.get_dimension_information(spec)}
     
     def match_inds(self, spec=None):
-        """ Recursive generator to find all indicators that are in 
-        the API and fit the given indicator specification dict. 
+        """ Generator to find all indicators that are in the API and fit 
+        the given indicator specification dict. 
         Yields the indicators as dicts of dimensions and values.
         
         Not specifying spec will return all indicators available in the API
+        
+        Specs are worked through depth first from an explicit stack rather 
+        than by recursion, with one keys only query per spec that still has
+        more than one undetermined dimension.
         """
         if spec is None:
-            spec = {}
+            stack = [{}]
         else:
-            spec = self.filter.extract_dims(spec)
-        undetermined = {}
-        determined = {}
-        for dim_id, value_ids in self.scope(spec).items():
-            if self.filter.is_dim(dim_id):
-                if len(value_ids) == 0: # shouldn't happen
-                    raise ValueError("No values found for {}".format(dim_id))
-                elif len(value_ids) == 1:
-                    determined[dim_id] = value_ids[0]
-                else:
-                    undetermined[dim_id] = value_ids    
-        if undetermined:
+            stack = [self.filter.extract_dims(spec)]
+        while stack:
+            spec = stack.pop()
+            undetermined = {}
+            determined = {}
+            for dim_id, value_ids in self.scope(spec).items():
+                if self.filter.is_dim(dim_id):
+                    if len(value_ids) == 0: # shouldn't happen
+                        raise ValueError("No values found for {}".format(dim_id))
+                    elif len(value_ids) == 1:
+                        determined[dim_id] = value_ids[0]
+                    else:
+                        undetermined[dim_id] = value_ids    
+            if not undetermined:
+                yield determined
+                continue
             first_dim, first_value_ids = next(iter(undetermined.items()))
-            for value_id in first_value_ids:
-                determined[first_dim] = value_id
-                if len(undetermined) == 1:
-                    yield determined
-                else: # >1 undetermined value, so we need to do another query
-                    yield from self.match_inds(spec=determined)
-                    #for ind in self.match_inds(spec=determined):
-                    #    yield ind
-        else:
-            yield determined
-        
+            found = [{**determined, first_dim: value_id} 
+                     for value_id in first_value_ids]
+            if len(undetermined) == 1:
+                yield from found
+            else: # >1 undetermined value, so we need to do another query
+                stack.extend(reversed(found))
+
+
+def make_session(cache_name=None, cache_expiry=86400, retries=3):
+    """ 
+    Returns a requests session, which reuses connections between requests.
+    Connection errors and server errors (429 and 5xx) are retried up to
+    retries times, waiting longer after each attempt.
+    
+    If cache_name is given, responses are also stored in an SQLite database 
+    of that name for cache_expiry seconds, so repeated queries do not go 
+    back to the server. This requires the requests-cache package. The
+    subscription key is left out of the cache.
+    """
+    if cache_name is None:
+        session = requests.Session()
+    else:
+        import requests_cache
+        session = requests_cache.CachedSession(cache_name, backend="sqlite",
+                                        expire_after=cache_expiry,
+                                        allowable_methods=("GET",),
+                                        ignored_parameters=["subscription-key"])
+    retry = Retry(total=retries, backoff_factor=0.5, 
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=("GET",), raise_on_status=False)
+    adapter = HTTPAdapter(max_retries=retry)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
 
 def combine_queries(*query_dicts):
     """
@@ -192,20 +270,22 @@ def combine_queries(*query_dicts):
     r = defaultdict(set)
     for d in query_dicts:
         for key, value in d.items():
-            if type(value) is list:
-                r[key] |= set(value)
+            if isinstance(value, (list, tuple)):
+                r[key].update(value)
             else:
                 r[key].add(value)
     return {k: list(v) for k, v in r.items()}
  
 def value_to_filter_string(v):
     """ 
-    Convert None, a number, string or list into a string for 
+    Convert None, a number, string, list or tuple into a string for 
     inclusion in an SDMX filter string
     """
-    if v is None:
+    if isinstance(v, str):
+        return v
+    elif v is None:
         return ""
-    elif type(v) == list:
+    elif isinstance(v, (list, tuple)):
         return "+".join(v)
     else:
         return str(v)
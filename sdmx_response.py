@@ -11,6 +11,11 @@ However the string values are generally preserved in the dataset
 from collections import defaultdict, Counter
 from const_flag import Flag
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 def endless_defaultdict():
     return defaultdict(endless_defaultdict)
 
@@ -23,6 +28,27 @@ def defaultdict_to_dict(d):
 
 
 
+def parse_json(response):
+    """ Parse the JSON body of a requests response, using orjson if it is
+    installed as it is faster on large SDMX messages """
+    if orjson is None:
+        return response.json()
+    return orjson.loads(response.content)
+
+
+def joined_ids(positions, value_ids, columns):
+    """ The SDMX key (IDs joined with ".") of each row of positions, a 
+    matrix of the position of each dimension's value, using only the given
+    columns. Each distinct combination is only joined once. """
+    import numpy as np
+    columns = list(columns)
+    distinct, inverse = np.unique(positions[:, columns], axis=0, 
+                                  return_inverse=True)
+    keys = np.array([".".join(value_ids[c][p] for c, p in zip(columns, row))
+                     for row in distinct.tolist()], dtype=object)
+    return keys[inverse.reshape(-1)]
+
+
 def key_to_list(key):
     """ Convert an SDMX numerical key like 0:0:0... to a list of integers """
     return [int(part) for part in key.split(":")]
@@ -47,6 +73,23 @@ class cached_property(object):
         value = obj.__dict__[self.func.__name__] = self.func(obj)
         return value
     
+
+class cached_class_property(object):
+    """
+    A class-level property that is only computed once, on first access from
+    the class or an instance, and then replaces itself with an ordinary
+    class attribute.
+    """
+    
+    def __init__(self, func):
+        self.__doc__ = getattr(func, "__doc__")
+        self.func = func
+
+    def __get__(self, obj, cls):
+        value = self.func(cls)
+        setattr(cls, self.func.__name__, value)
+        return value
+    
     
 class cached_gen(object):
     """
@@ -77,7 +120,7 @@ METADATA = Flag("Metadata", "DIMENSIONS ATTRIBUTES ATTRIBUTE_DESCRIPTIONS EXCEPT
 class SdmxResponse(object):
     def __init__(self, response):
         self.response = response
-        self.message = response.json()
+        self.message = parse_json(response)
         self.structured = False
         
     @cached_property
@@ -162,6 +205,38 @@ class SdmxResponse(object):
         return r
     
     
+    @cached_property
+    def positions(self):
+        """ Matrix of the position of each observation's value in each 
+        dimension (one row per observation), parsed from all of the 
+        numerical keys at once """
+        import numpy as np
+        return np.array(":".join(self.data.keys()).split(":"), 
+                        dtype=np.intp).reshape(len(self.data), -1)
+    
+    @cached_property
+    def value_ids(self):
+        """ Array of the value IDs of each dimension, for indexing with
+        positions """
+        import numpy as np
+        return [np.array([v["id"] for v in d["values"]], dtype=object)
+                for d in self.dimensions]
+    
+    def parse_keys(self):
+        """ parse_key for all of the observations, in the same order as 
+        data, computed for all observations at once """
+        positions, value_ids = self.positions, self.value_ids
+        dimension_ids = [d["id"] for d in self.dimensions]
+        if self.structured:
+            ref_area = dimension_ids.index(self.ref_area)
+            time_period = dimension_ids.index(self.time_period)
+            indicators = joined_ids(positions, value_ids, 
+                [dimension_ids.index(d) for d in self.indicator_dimensions])
+            return list(zip(indicators, 
+                            value_ids[ref_area][positions[:, ref_area]],
+                            value_ids[time_period][positions[:, time_period]]))
+        return list(joined_ids(positions, value_ids, range(len(dimension_ids))))
+    
     @cached_property
     def dataframe(self):
         """ Convert an SDMX response containing data to a pandas dataframe
@@ -171,27 +246,26 @@ class SdmxResponse(object):
             Renames headings using the given function
         """
         import pandas as pd
-        dimension_ids = []
-        attribute_ids = []
-        maps = {}
-        for d in self.dimensions:
-            maps[d["id"]] = pd.Series(v["id"] for v in d["values"])
-            dimension_ids.append(d["id"])
-        for a in self.attributes:
-            maps[a["id"]] = pd.Series(v["name"] for v in a["values"])
-            attribute_ids.append(a["id"])
-        columns = dimension_ids + ["Value as string"] + attribute_ids
-        data = (key_to_list(k) + v for k, v in self.data.items())
-        r = pd.DataFrame(data=data, columns=columns)
-        r["Value"] = pd.to_numeric(r["Value as string"], errors="coerce")
+        dimension_ids = [d["id"] for d in self.dimensions]
+        attribute_ids = [a["id"] for a in self.attributes]
+        positions, value_ids = self.positions, self.value_ids
         
         # Replace dimension and attribute numbers with the relevant ID / name
-        for column, series in maps.items():
-            r[column] = r[column].map(series)
+        observations = pd.DataFrame(list(self.data.values()), 
+                                    columns=["Value as string"] + attribute_ids)
+        columns = {d: ids[positions[:, i]] 
+                   for i, (d, ids) in enumerate(zip(dimension_ids, value_ids))}
+        columns["Value as string"] = observations["Value as string"]
+        for a in self.attributes:
+            names = pd.Series(v["name"] for v in a["values"])
+            columns[a["id"]] = observations[a["id"]].map(names)
+        r = pd.DataFrame(columns)
+        r["Value"] = pd.to_numeric(r["Value as string"], errors="coerce")
         
-        r["Key"] = r[dimension_ids].apply(".".join, axis=1)
+        r["Key"] = joined_ids(positions, value_ids, range(len(dimension_ids)))
         if self.structured:
-            r["Indicator key"] = r[self.indicator_dimensions].apply(".".join, axis=1)
+            r["Indicator key"] = joined_ids(positions, value_ids, 
+                [dimension_ids.index(d) for d in self.indicator_dimensions])
         return r
     
     
@@ -204,11 +278,18 @@ class SdmxResponse(object):
         else:
             use = lambda d: True
         
-        for observation_key in self.data.keys():
-            zipped = list(zip(self.dimensions, key_to_list(observation_key)))
-            key_string = ".".join(d["values"][v]["id"] for d, v in zipped if use(d))
+        # Find the distinct combinations of the dimension values first, so
+        # that each indicator is only looked up once
+        positions = [i for i, d in enumerate(self.dimensions) if use(d)]
+        dimensions = [self.dimensions[i] for i in positions]
+        distinct = dict.fromkeys(tuple(parts[i] for i in positions) for parts 
+                                 in (k.split(":") for k in self.data.keys()))
+        for numbers in distinct:
+            values = [d["values"][int(v)] for d, v in zip(dimensions, numbers)]
+            key_string = ".".join(v["id"] for v in values)
             if not key_string in r:
-                r[key_string] = {d["name"]: d["values"][v]["name"] for d, v in zipped if use(d)}
+                r[key_string] = {d["name"]: v["name"] 
+                                 for d, v in zip(dimensions, values)}
         return r
     
     
@@ -256,12 +337,12 @@ class SdmxResponse(object):
         """
         # Return an ind: {country: {year: value}} nested dictionary
         r = defaultdict(lambda: defaultdict(dict))
-        for k, v in self.data.items():
+        for parsed, v in zip(self.parse_keys(), self.data.values()):
             if self.structured:
-                i, c, y = self.parse_key(k)
+                i, c, y = parsed
                 r[i][c][y] = v[0]
             else:
-                r[self.parse_key(k)] = v[0]
+                r[parsed] = v[0]
                 
         if metadata:
             r["metadata"] = self.get_metadata(metadata)
@@ -275,12 +356,13 @@ class SdmxResponse(object):
         the most common values. 
         """
         r = endless_defaultdict()
-        for observation_key, observation_value in self.data.items():
+        for parsed, observation_value in zip(self.parse_keys(), 
+                                             self.data.values()):
             if self.structured:
-                i, c, y = self.parse_key(observation_key)
+                i, c, y = parsed
                 d = lambda: r[i][c][y]
             else:
-                d = lambda: r[self.parse_key(observation_key)]
+                d = lambda: r[parsed]
             z = zip(self.attributes, 
                     observation_value[1:], 
                     self.most_common_attribute_numbers)
@@ -8,12 +8,14 @@ Created on Wed Jul 31 10:51:35 2019
 """
 import re
 import string
+from functools import lru_cache
 
 UNPUNCTUATED = str.maketrans(string.punctuation, ' '*len(string.punctuation))
 # Regexes (can be improved but good enough!)
 NOT_SNAKE = re.compile(r"[^a-z0-9_]")  
 NOT_UPPER_SNAKE = re.compile(r"[^A-Z0-9_]")
 NOT_CAMEL = re.compile(r"[^a-zA-Z0-9]")
+CAMEL_BOUNDARY = re.compile(r"(?:^|_)(.)")
 
 
 def is_snake(s):
@@ -63,6 +65,7 @@ def clean_label(s):
 #    return re.sub("[^a-z0-9]", " ", s.lower())
 
 
+@lru_cache(maxsize=None)
 def camel(k):
     """ 
     Appropriately camelize a keyword argument key for inclusion in 
@@ -70,6 +73,7 @@ def camel(k):
     e.g. start_period => startPeriod 
     
     (Taken from inflection package)
+    The same few keys are used in every query, so results are cached.
     """
-    return k[0].lower() + re.sub(r"(?:^|_)(.)", lambda m: m.group(1).upper(), k)[1:]
+    return k[0].lower() + CAMEL_BOUNDARY.sub(lambda m: m.group(1).upper(), k)[1:]
     #return inflection.camelize(k, uppercase_first_letter=False)
\ No newline at end of file
@@ -11,17 +11,18 @@ the API query can be filtered, e.g. query_df(df, ref_area=["BD", "TZ"], sex="F")
 """
 import csv
 import os
+import string
+import sys
 import logging as lg
-from itertools import permutations, chain
+from collections import defaultdict, Counter
+from functools import lru_cache, reduce
+from itertools import chain
+from operator import or_
 
 import string_utils
 import sdmx_api
-from sdmx_response import SdmxResponse, METADATA, cached_property
-
-try:
-    from hdx.location.country import Country
-except ImportError:
-    pass
+from sdmx_response import (SdmxResponse, METADATA, cached_property, 
+                           cached_class_property)
 
 UIS_BASE = "https://api.uis.unesco.org/sdmx/data/UNESCO,EDU_NON_FINANCE,3.0"
 UIS_DIMENSIONS = [
@@ -51,66 +52,172 @@ UIS_DIMENSIONS = [
 lg.info("CWD={}; file path={}".format(os.getcwd(), os.path.dirname(__file__)))
 INDICATOR_DATA = os.path.join(os.path.dirname(__file__), "input-data/combined indicators.csv")
 uis_filter = sdmx_api.Filter(UIS_DIMENSIONS)
+COUNTRY_ISO2 = "#country+code+v_iso2"   # HDX column used to index countries
+
 
 
 
+@lru_cache(maxsize=None)
+def get_country_class():
+    """ The HDX Country class, or None if hdx-python-country is not installed.
+    It is slow to import, so this is only done the first time it is needed. """
+    try:
+        from hdx.location.country import Country
+    except ImportError:
+        return None
+    return Country
+
 
 def get_iso2(s, use_live=False):
-    if Country:
+    """ Look up the ISO2 code for a country name or code. Results from the
+    bundled country data are cached so repeated queries for the same 
+    countries skip the fuzzy match; live lookups are not cached. """
+    s = s.strip().casefold()
+    if use_live:
+        return _lookup_iso2(s, use_live=True)
+    return _cached_iso2(s)
+
+
+@lru_cache(maxsize=4096)
+def _cached_iso2(s):
+    return _lookup_iso2(s, use_live=False)
+
+
+def _lookup_iso2(s, use_live=False):
+    Country = get_country_class()
+    if Country is not None:
+        if len(s) == 2 and Country.get_iso3_from_iso2(s, use_live):
+            return s.upper()    # already an ISO2 code
         iso3, fuzzy = Country.get_iso3_country_code_fuzzy(s, use_live)
         if iso3:
-            return Country.get_country_info_from_iso3(iso3)["#country+code+v_iso2"]
+            return Country.get_country_info_from_iso3(iso3)[COUNTRY_ISO2]
     else:
         return s.upper()
 
 
+@lru_cache(maxsize=None)
 def get_indicator_keys():
     """ 
     Returns a list of dicts containing information on all of the UIS
     indicators, from information in a CSV file.
+    The file is only read once; later calls return the same dict.
     """
     key_types = ["key", "short_key", "Indicator ID", "Indicator Label - EN"]
-    keys = {k: [] for k in key_types}
-    with open(INDICATOR_DATA, "r") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            for t in key_types:
-                keys[t].append(row[t])
+    try:
+        df = _read_indicator_df(frozenset(key_types))
+    except ImportError:
+        keys = {k: [] for k in key_types}
+        with open(INDICATOR_DATA, "r") as f:
+            reader = csv.DictReader(f)
+            for row in reader:
+                for t in key_types:
+                    keys[t].append(row[t])
+        keys["id_lower"] = [k.lower() for k in keys["Indicator ID"]]
+        keys["key_lower"] = [k.lower() for k in keys["key"]]
+    else:
+        df = df.fillna("")   # empty labels are read as missing
+        keys = {t: df[t].tolist() for t in key_types if t != "key"}
+        keys["key"] = df.index.tolist()
+        keys["id_lower"] = df["id_lower"].tolist()
+        keys["key_lower"] = df["key_lower"].tolist()
     keys["id"] = keys["Indicator ID"]
-    keys["id_lower"] = [k.lower() for k in keys["id"]]
-    keys["key_lower"] = [k.lower() for k in keys["key"]]
+    # The same few hundred parts recur across thousands of keys, so each 
+    # part is stored once
+    keys["key_parts"] = [split_interned(k, ".") for k in keys["key"]]
+    keys["short_key_parts"] = [split_interned(k, "-") for k in keys["short_key"]]
+    keys["key_lower_parts"] = [split_interned(k, ".") for k in keys["key_lower"]]
+    keys["id_lower_parts"] = [split_interned(k, ".") for k in keys["id_lower"]]
     keys["label"] = keys["Indicator Label - EN"]
     return keys
 
 
+def split_interned(s, sep):
+    """ Split s into a tuple of interned strings """
+    return tuple(map(sys.intern, s.split(sep)))
+
+
 def get_indicator_df(columns=None):
     """
     Returns a Pandas dataframe based on the CSV file with ID etc. added for 
     easy lookup, indexed by SDMX key
     """
-    import pandas as pd
     if columns is not None:
-        columns = set(list(columns) + ["Indicator ID", "key"])
-    df = pd.read_csv(INDICATOR_DATA, usecols=columns)
-    df["id_lower"] = df["Indicator ID"].str.lower()
-    df["key_lower"] = df["key"].str.lower()    
+        columns = frozenset(list(columns) + ["Indicator ID", "key"])
+    return _read_indicator_df(columns).copy()
+
+
+@lru_cache(maxsize=None)
+def _read_indicator_df(columns):
+    """ Cached read of the indicator CSV file for get_indicator_df.
+    columns must be None or a frozenset so that it can be hashed. """
+    try:
+        df = _read_indicator_table(columns).to_pandas()
+    except ImportError:
+        import pandas as pd
+        df = pd.read_csv(INDICATOR_DATA, usecols=columns)
+        df["id_lower"] = df["Indicator ID"].str.lower()
+        df["key_lower"] = df["key"].str.lower()    
     df.set_index("key", inplace=True)
     #if columns is not None:
     #    df = df[columns]
     return df
 
 
+def _read_indicator_table(columns=None):
+    """ Read the indicator CSV file into a pyarrow Table using the
+    multi-threaded Arrow reader, with lower case ID and key columns added.
+    Duplicate headings are renamed as pandas does ("Indicator ID.1").
+    Raises ImportError if pyarrow is not installed. """
+    import pyarrow.csv as pacsv
+    import pyarrow.compute as pc
+    with open(INDICATOR_DATA, "r") as f:
+        header = next(csv.reader(f))
+    seen = Counter()
+    column_names = []
+    for heading in header:
+        column_names.append(heading if not seen[heading] 
+                            else "{}.{}".format(heading, seen[heading]))
+        seen[heading] += 1
+    if columns is None:
+        include_columns = []    # i.e. all columns
+    else:
+        include_columns = [c for c in column_names if c in columns]
+    table = pacsv.read_csv(INDICATOR_DATA, 
+        read_options=pacsv.ReadOptions(column_names=column_names, skip_rows=1),
+        convert_options=pacsv.ConvertOptions(include_columns=include_columns,
+                                             strings_can_be_null=True))
+    table = table.append_column("id_lower", pc.utf8_lower(table["Indicator ID"]))
+    return table.append_column("key_lower", pc.utf8_lower(table["key"]))
+
+
 def get_country_df(columns=None):
     """
     Convert the HDX country database into a dataframe, indexed by ISO2
     If columns is not None, select the specified list of columns only.
+    In that case only those columns are built, directly from the records.
     """
-    import pandas as pd
-    country_data = Country.countriesdata(use_live=False)["countries"]
-    df = pd.DataFrame.from_records(list(country_data.values()))
-    df.set_index("#country+code+v_iso2", inplace=True)
     if columns is not None:
-        df = df[list(columns)]
+        columns = tuple(columns)
+    return _build_country_df(columns).copy()
+
+
+@lru_cache(maxsize=None)
+def _build_country_df(columns):
+    """ Cached conversion of the HDX country database for get_country_df.
+    columns must be None or a tuple so that it can be hashed. """
+    import pandas as pd
+    country_data = get_country_class().countriesdata(use_live=False)["countries"]
+    records = country_data.values()
+    if columns is None:
+        df = pd.DataFrame.from_records(list(records))
+    else:
+        # Every record must have the ISO2 code used as the index; other
+        # requested columns may be missing from some records
+        data = {COUNTRY_ISO2: [record[COUNTRY_ISO2] for record in records]}
+        data.update((c, [record.get(c) for record in records]) 
+                    for c in columns)
+        df = pd.DataFrame(data, columns=[COUNTRY_ISO2] + list(columns))
+    df.set_index(COUNTRY_ISO2, inplace=True)
     return df
 
 
@@ -124,13 +231,25 @@ class allbut(object):
     
     def __rsub__(self, other):
         return list(set(other) - self.members)
-        
-def get_filters(df, filter_dict):
-    """ 
-    Generate filter columns based on a dictionary of column names
-    and values
-    Values can be individual strings/values, lists, or instances of allbut
-    """    
+
+
+def first_indices(L):
+    """ Dictionary mapping each item in L to the index of its first
+    occurrence, i.e. an O(1) replacement for L.index """
+    r = {}
+    for i, item in enumerate(L):
+        r.setdefault(item, i)
+    return r
+
+
+@lru_cache(maxsize=128)
+def get_altered_columns(columns):
+    """
+    Returns dicts mapping transformed versions of the column headings 
+    (lower case, then cleaned labels) to the original headings. Cached so
+    that repeatedly filtering the same dataframe does not redo this.
+    columns must be a tuple.
+    """
     def transform1(heading):
         if isinstance(heading, str):
             return heading.lower()
@@ -143,40 +262,56 @@ def get_filters(df, filter_dict):
         else:
             return heading
     
-    funcs = [transform1, transform2]
-    altered_columns = [(f, {f(h): h for h in df.columns}) for f in funcs]
+    return [{f(h): h for h in columns} for f in [transform1, transform2]]
+
+
+def get_filters(df, filter_dict):
+    """
+    Generate filter columns based on a dictionary of column names
+    and values
+    Values can be individual strings/values, lists, or instances of allbut
+    Each filter is yielded as a boolean numpy array, with missing values
+    (e.g. pd.NA in nullable columns) treated as not matching
+    """
+    altered_columns = get_altered_columns(tuple(df.columns))
     for k, v in filter_dict.items():
         if k not in df.columns:
-            for transform, headings in altered_columns:
+            for headings in altered_columns:
                 if k in headings:
                     k = headings[k]
                     break
             else:
                 raise KeyError("Keyword {} not found in dataset".format(k))
         if isinstance(v, list):
-            yield df[k].isin(v)
+            yield df[k].isin(v).to_numpy(dtype=bool, na_value=False)
         elif isinstance(v, allbut):
-            yield ~df[k].isin(v.members)
+            yield ~df[k].isin(v.members).to_numpy(dtype=bool, na_value=False)
         else:
-            yield df[k] == v   
-    
+            yield (df[k] == v).to_numpy(dtype=bool, na_value=False)
+
 def filter_df(df, **kwargs):
     """
     Convenience filter for dataframes
     Allows slightly fuzzy matching to column headings e.g. 'stat_unit'
     will match 'STAT_UNIT' or 'Stat. Unit' if an exact match isn't found
     """
-    import pandas as pd
-    return df[pd.DataFrame(get_filters(df, kwargs)).all()]
+    import numpy as np
+    mask = np.ones(len(df), dtype=bool)
+    for f in get_filters(df, kwargs):
+        mask &= f
+    return df[mask]
 
 def drop_redundant_cols(df):
     """
     Remove all columns which are all the same
     Returns the values of those columns and the remaining df
     Taken from https://stackoverflow.com/a/39658662/567595
+    Columns whose first and last values differ cannot be all the same, so
+    they are skipped before counting unique values
     """
-    import pandas as pd
-    nunique = df.apply(pd.Series.nunique)
+    first, last = df.iloc[0], df.iloc[-1]
+    differ = (first != last) & first.notna() & last.notna()
+    nunique = df.loc[:, ~differ.to_numpy()].nunique()
     cols_to_drop = nunique[nunique == 1].index
     return df[cols_to_drop].iloc[0], df.drop(cols_to_drop, axis=1)            
     
@@ -189,12 +324,16 @@ class Api(sdmx_api.Api):
     This is a tailored version of the more generic sdmx_api.
     """
 
-    def __init__(self, subscription_key):
+    def __init__(self, subscription_key, cache_name=None, cache_expiry=86400,
+                 memoize=False):
         #self.super = super(Api, self)
         self.super = super()
         self.super.__init__(base=UIS_BASE,
                                 subscription_key=subscription_key,
-                                dimensions=UIS_DIMENSIONS)
+                                dimensions=UIS_DIMENSIONS,
+                                cache_name=cache_name,
+                                cache_expiry=cache_expiry,
+                                memoize=memoize)
         self.process_response = Response
         
         
@@ -236,11 +375,12 @@ class Response(SdmxResponse):
         self.set_structure(ref_area="REF_AREA", time_period="TIME_PERIOD")
         
     def get_nested(self, metadata=METADATA.ALL):
+        key_to_id = Indicator.key_to_id
         def adjust_key(k):
             if k != "metadata":
                 try:
-                    return Indicator(key=k).id
-                except:
+                    return key_to_id.get(k.lower(), k)
+                except AttributeError:
                     pass
             return k
         
@@ -254,6 +394,7 @@ class Response(SdmxResponse):
     
     @cached_property
     def dataframe(self):
+        import pandas as pd
         df = self.super.dataframe
         df = add_country_info_to_df(df, {
                 "#country+name+preferred": "Country name",
@@ -266,7 +407,15 @@ class Response(SdmxResponse):
                 'Table query', 
                 'Theme'
                 ])
-        df["Year"] = df["TIME_PERIOD"].astype("int")
+        # Nullable Int64 so that any period which is not a year is kept as
+        # missing, without overflowing arithmetic on the years
+        year = pd.to_numeric(df["TIME_PERIOD"], errors="coerce")
+        not_years = year.isna() & df["TIME_PERIOD"].notna()
+        if not_years.any():
+            lg.warning("Time periods that are not years set to missing: "
+                       "{}".format(sorted(df.loc[not_years, "TIME_PERIOD"]
+                                          .astype(str).unique())))
+        df["Year"] = year.astype("Int64")
         #df.rename(columns=header_case, inplace=True)
         return df
     
@@ -289,18 +438,34 @@ def merge_df(left, lookup_func, on, columns=None):
                   a list - adds listed columns from the second dataset
                   a dict - adds listed columns in the second dataset
                           and renames them when adding to the first dataset
+    
+    Each column is added with Series.map rather than a full merge, so
+    the rows of the first dataset are not copied. As with an inner merge,
+    rows with no match in the second dataset are dropped. Also as with a 
+    merge, a column name found in both datasets is kept from each, with
+    suffixes _x (first dataset) and _y (second dataset). Renaming a column
+    to a name already in the first dataset adds a second column of that name.
     """
+    import pandas as pd
     try:
         lookup_columns = columns.keys()
-        rename = True
+        rename = columns
     except AttributeError:
         lookup_columns = columns
-        rename = False
+        rename = {}
     right = lookup_func(columns=lookup_columns)
-    df = left.merge(right=right, left_on=on, right_index=True)
-    if rename:
-        df.rename(columns=columns, inplace=True)
-    return df
+    right = right[~right.index.duplicated()]
+    found = left[on].isin(right.index)
+    if not found.all():
+        left = left[found]
+    key = left[on]
+    overlap = right.columns.intersection(left.columns)
+    if len(overlap):
+        left = left.rename(columns={c: c + "_x" for c in overlap})
+        rename = {**rename, **{c: c + "_y" for c in overlap}}
+    added = pd.DataFrame({rename.get(c, c): key.map(right[c]) 
+                          for c in right.columns}, index=left.index)
+    return pd.concat([left, added], axis=1)
 
 
 class Indicator(object):
@@ -314,28 +479,94 @@ class Indicator(object):
     combined with information obtained directly from the UIS data API.
     
     """
-    keys = get_indicator_keys()
+    __slots__ = ("key", "short_key", "id", "label", "_index", "_sort_key")
     key_types = ["key", "short_key", "id"] 
+    _instances = {}
+    _similarity_groups = {}
     SUB = object()
     ALL = object()    
     
-    def __init__(self, id=None, key=None, short_key=None, index=None):
+    # The indicator information is read from the CSV file on first use 
+    # rather than when the module is imported
+    @cached_class_property
+    def keys(cls):
+        return get_indicator_keys()
+    
+    @cached_class_property
+    def _records(cls):
+        keys = cls.keys
+        return list(zip(keys["key"], keys["short_key"], keys["id"], 
+                        keys["label"], keys["short_key_parts"]))
+    
+    @cached_class_property
+    def _key_index(cls):
+        return first_indices(cls.keys["key_lower"])
+    
+    @cached_class_property
+    def _id_index(cls):
+        return first_indices(cls.keys["id_lower"])
+    
+    @cached_class_property
+    def _short_key_index(cls):
+        return first_indices(cls.keys["short_key"])
+    
+    @cached_class_property
+    def key_to_id(cls):
+        """ Dictionary of the indicator ID for each lower case key, e.g. for
+        use with pandas Series.map """
+        return {k: cls.keys["id"][i] for k, i in cls._key_index.items()}
+    
+    @cached_class_property
+    def _clean_labels(cls):
+        return [string_utils.clean_label(k) for k in cls.keys["label"]]
+    
+    @cached_class_property
+    def _label_words(cls):
+        return [frozenset(label.split(" ")) for label in cls._clean_labels]
+    
+    def __new__(cls, id=None, key=None, short_key=None, index=None):
+        """ Indicators are not modified after creation, so one instance is
+        created for each indicator and shared by later lookups """
         if index is None:
-            index = self._get_index(key, id, short_key)
-        self.key, self.short_key, self.id = (self.keys[t][index]
-            for t in self.key_types)
-        self.label = self.keys["label"][index]
-        self.spec = uis_filter.key_to_dict(self.key)
+            index = cls._get_index(key, id, short_key)
+        try:
+            return cls._instances[index]
+        except KeyError:
+            pass
+        self = super().__new__(cls)
+        (self.key, self.short_key, self.id, self.label, 
+         self._sort_key) = cls._records[index]
+        self._index = index
+        cls._instances[index] = self
+        return self
+    
+    @property
+    def spec(self):
+        """ Dictionary of the dimensions of the indicator. This is shared
+        by all instances of the same indicator, so should not be modified. """
+        return self._specs[self._index]
+    
+    @cached_class_property
+    def _specs(cls):
+        """ Spec dictionaries for all indicators (as given by 
+        uis_filter.key_to_dict) """
+        dims = uis_filter.dims()
+        return [dict(zip(dims, parts)) for parts in cls.keys["key_parts"]]
     
     
     @classmethod
     def _get_index(cls, key=None, id=None, short_key=None):
-        if key:
-            return cls.keys["key_lower"].index(key.lower())
-        elif id:
-            return cls.keys["id_lower"].index(id.lower())
-        elif short_key:
-            return cls.keys["short_key"].index(short_key.lower())
+        """ Index of the indicator with the given key, id or short key.
+        Raises ValueError if it is not found (as list.index did) """
+        try:
+            if key:
+                return cls._key_index[key.lower()]
+            elif id:
+                return cls._id_index[id.lower()]
+            elif short_key:
+                return cls._short_key_index[short_key.lower()]
+        except KeyError as e:
+            raise ValueError("{!r} is not in list".format(e.args[0])) from None
         
         
     @classmethod
@@ -352,7 +583,8 @@ class Indicator(object):
             result = [cls.lookup(s) for s in lookup]
         else:
             result = [cls.lookup(lookup)]
-        return sorted(cls.disaggregate_inds(result, by, disag_only))
+        return sorted(cls.disaggregate_inds(result, by, disag_only),
+                      key=cls.comparison_key)
         
     @classmethod
     def lookup(cls, s):
@@ -361,12 +593,9 @@ class Indicator(object):
             s = s.lower()
         except AttributeError:
             return s   # Not a string so just try returning it directly
-        if s in cls.keys["key_lower"]:
-            return cls(key=s)
-        if s in cls.keys["id_lower"]:
-            return cls(id=s)
-        if s in cls.keys["short_key"]:
-            return cls(short_key=s)
+        for index in (cls._key_index, cls._id_index, cls._short_key_index):
+            if s in index:
+                return cls(index=index[s])
         raise KeyError("Key {} not found".format(s))
     
     @classmethod
@@ -422,7 +651,8 @@ class Indicator(object):
             raise TypeError("by must be a string, list, SUB, ALL or None")
         
         def finalize(result):
-            return sorted(cls.disaggregate_inds(result, by, disag_only))
+            return sorted(cls.disaggregate_inds(result, by, disag_only),
+                          key=cls.comparison_key)
 
         def interpret_indices(indices):
             if indices:
@@ -442,8 +672,10 @@ class Indicator(object):
                     if not matches:
                         return None
                 if shortest:
-                    min_length = min(m.parts() for m in matches)
-                    matches = [m for m in matches if m.parts() == min_length]
+                    lengths = [m.parts() for m in matches]
+                    min_length = min(lengths)
+                    matches = [m for m, n in zip(matches, lengths) 
+                               if n == min_length]
                 if len(matches) == 1 or allow_multiple:
                     return matches
             return None
@@ -461,23 +693,45 @@ class Indicator(object):
         for match in [strict_key_match, loose_key_match]:
             lg.info("Attempting to match using %s", match)
             indices = set()
-            for lookup in ["short_key", "key_lower", "id_lower"]:
-                if lookup == "short_key":
-                    sep = "-"
+            # Each part of a key can match only one search part, so keys with
+            # fewer parts than the search are skipped before matching
+            for (all_parts, part_index, gram_index, 
+                 part_matrix) in cls._lookup_tables:
+                # Only check the keys that could possibly match
+                if match is strict_key_match:
+                    candidates = index_intersection(part_index, substrings)
+                    if len(set(substrings)) == len(substrings):
+                        # every key in the intersection contains all of the
+                        # parts, so no further check is needed
+                        indices |= candidates
+                        continue
+                    indices.update(i for i in candidates 
+                                   if len(all_parts[i]) >= len(substrings)
+                                   and match(substrings, all_parts[i]))
                 else:
-                    sep = "."            
-                for i, key in enumerate(cls.keys[lookup]):
-                    key_parts = key.split(sep)
-                    if match(substrings, key_parts):
-                        indices.add(i)
+                    # Find the distinct key parts containing each search part
+                    # in one pass, rather than testing every key separately
+                    containing = [parts_containing(p, part_index, gram_index)
+                                  for p in substrings]
+                    if (part_matrix is not None 
+                        and len(substrings) <= MAX_VECTORISED_PARTS):
+                        indices.update(loose_match_rows(
+                            containing, part_index, part_matrix).tolist())
+                        continue
+                    candidates = set.intersection(
+                        *[set().union(*(part_index[k] for k in c)) 
+                          for c in containing])
+                    indices.update(i for i in candidates 
+                                   if len(all_parts[i]) >= len(substrings)
+                                   and match(substrings, all_parts[i], 
+                                             containing))
             r = interpret_indices(indices)
             if r:
                 return finalize(r)
                 
         # Then look for a label match
         lg.info("Trying a label match")
-        clean_labels = [string_utils.clean_label(k) for k in cls.keys["label"]]
-        indices = best_matches(s, clean_labels)
+        indices = best_matches(s, cls._clean_labels, cls._label_words)
         r = interpret_indices(indices)
         if r:
             return finalize(r)
@@ -498,10 +752,19 @@ class Indicator(object):
         
     def get_relations(self, relation, reverse=False):
         """ Get all indicator short keys for which the relation function is True """
+        if relation in MASK_RELATIONS:
+            # Compare bitmasks of the short key parts rather than sets
+            return list(get_relations(short_key=self.short_key,
+                                      all_short_keys = self.keys["short_key"],
+                                      relation=MASK_RELATIONS[relation],
+                                      reverse=reverse,
+                                      all_parts=self._short_key_masks,
+                                      encode=short_key_mask))
         return list(get_relations(short_key=self.short_key,
                                   all_short_keys = self.keys["short_key"],
                                   relation=relation,
-                                  reverse=reverse))
+                                  reverse=reverse,
+                                  all_parts=self.keys["short_key_parts"]))
     
     def get_parents(self):
         """ Yields all parents of the current indicator, i.e. indicators
@@ -519,13 +782,20 @@ class Indicator(object):
     
     def get_root(self):
         """ Return the first ancestor indicator that has no ancestors """
-        return get_root(self.short_key, self.keys["short_key"])
+        return get_root(self.short_key, self.keys["short_key"],
+                        self._short_key_masks)
     
     @classmethod
     def get_roots(cls):
         """ Yield all the root indicator short keys """
         for short_key in cls.keys["short_key"]:
-            yield short_key, get_root(short_key, cls.keys["short_key"])
+            yield short_key, get_root(short_key, cls.keys["short_key"],
+                                      cls._short_key_masks)
+    
+    @cached_class_property
+    def _short_key_masks(cls):
+        """ All short keys encoded with short_key_mask """
+        return [short_key_mask(k) for k in cls.keys["short_key"]]
             
     @classmethod
     def get_root_set(cls):
@@ -534,16 +804,65 @@ class Indicator(object):
     @classmethod
     def match_spec(cls, spec):
         """ List all indicators in the dictionary that fit a given specification
-        TODO: This is slow for some reason
-        Simply converting all keys to dicts takes some time.
-        Consider making a version that compares lists instead of dictionary. """
-        def gen():
-            for key in cls.keys["key"]:
-                ind = uis_filter.key_to_dict(key)
-                if specs_match(spec, ind):
-                    yield cls(key=key)
-                    
-        return list(gen())
+        Each dimension value is compared as an integer code across all 
+        indicators at once (using numpy if it is available). """
+        try:
+            import numpy as np
+        except ImportError:
+            return [cls(index=i) for i, ind in enumerate(cls._specs)
+                    if specs_match(spec, ind)]
+        matrix, dim_index, codes = cls._spec_matrix
+        mask = np.ones(len(matrix), dtype=bool)
+        for k, v in spec.items():
+            column = dim_index[k]
+            if v in [None, ""]:
+                continue
+            if not isinstance(v, str) or v not in codes[column]:
+                return []
+            mask &= matrix[:, column] == codes[column][v]
+        return [cls(index=i) for i in np.flatnonzero(mask)]
+    
+    @cached_class_property
+    def _lookup_tables(cls):
+        """
+        For each of the keys used in fuzzy_lookup (short key, key and ID),
+        returns a tuple of (the parts of each key, an index of the keys
+        containing each part, an index of the distinct parts containing each
+        character or pair of characters, and a matrix of the position of
+        each key part in the part index, or None if numpy is not available). 
+        """
+        r = []
+        for lookup in ["short_key", "key_lower", "id_lower"]:
+            all_parts = cls.keys[lookup + "_parts"]
+            part_index = defaultdict(set)
+            for i, parts in enumerate(all_parts):
+                for part in parts:
+                    part_index[part].add(i)
+            gram_index = defaultdict(set)
+            for part in part_index:
+                for gram in grams(part) | set(part):
+                    gram_index[gram].add(part)
+            r.append((all_parts, dict(part_index), dict(gram_index), 
+                      part_matrix(all_parts, part_index)))
+        return r
+    
+    @cached_class_property
+    def _spec_matrix(cls):
+        """ 
+        Returns a matrix of the dimension values of every indicator (one row
+        per indicator, one column per dimension) with each value encoded as an
+        integer, the column number of each dimension, and a list of
+        dicts mapping the values of each dimension to their codes.
+        """
+        import numpy as np
+        dims = uis_filter.dims()
+        codes = [{} for _ in dims]
+        matrix = np.array([[c.setdefault(part, len(c)) 
+                            for c, part in zip(codes, parts)]
+                           for parts in cls.keys["key_parts"]],
+                          dtype=np.uint16).reshape(-1, len(dims))
+        dim_index = {d: i for i, d in enumerate(dims)}
+        return matrix, dim_index, codes
               
     
     @classmethod
@@ -559,7 +878,7 @@ class Indicator(object):
         
     def parts(self):
         """ Number of parts of the short key """
-        return len(self.short_key.split("-"))
+        return len(self._sort_key)
     
     def similar(self, ignore):
         """ 
@@ -592,35 +911,54 @@ class Indicator(object):
         except ValueError:
             raise ValueError("Dimension does not exist")
         
-        def reduce_key(key):
+        keep = [i for i in range(len(uis_filter.dims())) 
+                if not i in ignore_indices]
+        
+        def reduce_key(parts):
             """
-            Converts an indicator key into a tuple of dimension values
-            removing the ignored dimensions
+            Converts the parts of an indicator key into a tuple of dimension
+            values removing the ignored dimensions
             """
-            return tuple(dim for i, dim in enumerate(key.split("."))
-                    if not i in ignore_indices)
+            return tuple(parts[i] for i in keep)
         
-        all_reduced_keys = [(k, reduce_key(k)) for k in cls.keys["key"]]
-        similar_keys = set()
+        groups = cls._get_similarity_groups(ignore_indices, reduce_key)
+        key_parts = cls.keys["key_parts"]
+        similar_indices = set()
         matched_needles = set()
         for ind in inds:
-            reduced = reduce_key(ind.key)
-            similar_to_ind = {k for k, r in all_reduced_keys
-                                if r == reduced and k != ind.key}
+            reduced = reduce_key(key_parts[ind._index])
+            similar_to_ind = set(groups.get(reduced, ())) - {ind._index}
             if similar_to_ind:
-                similar_keys |= similar_to_ind
+                similar_indices |= similar_to_ind
                 matched_needles.add(ind)
-        similar_inds = {cls(key=k) for k in similar_keys}
+        similar_inds = {cls(index=i) for i in similar_indices}
         return similar_inds, matched_needles
+    
+    @classmethod
+    def _get_similarity_groups(cls, ignore_indices, reduce_key):
+        """
+        Dictionary of the positions of all indicator keys grouped by their 
+        reduced key, i.e. with the dimensions at ignore_indices removed. The 
+        groups are computed once for each set of ignored dimensions.
+        """
+        cache_key = tuple(sorted(set(ignore_indices)))
+        if cache_key not in cls._similarity_groups:
+            groups = defaultdict(list)
+            for i, parts in enumerate(cls.keys["key_parts"]):
+                groups[reduce_key(parts)].append(i)
+            cls._similarity_groups[cache_key] = dict(groups)
+        return cls._similarity_groups[cache_key]
         
         
     #def __len__(self):
     #    return len(self.short_key)    
     def comparison_key(self):
-        return self.short_key.split("-")
+        """ Tuple of the parts of the short key, used for sorting. The
+        parts are split once when the indicator CSV is loaded. """
+        return self._sort_key
     
     def __lt__(self, other):
-        return self.comparison_key() < other.comparison_key()
+        return self._sort_key < other._sort_key
         
     def matches_spec(self, spec):
         """ Whether or not a given spec matches the indicator """
@@ -647,13 +985,30 @@ def max_indices(it):
     return highest, indices
 
 
-def best_matches(a, L):
+def max_int_indices(it):
+    """ As max_indices, for an iterable of integers. Uses numpy to find the
+    maxima where it is available. """
+    try:
+        import numpy as np
+    except ImportError:
+        return max_indices(it)
+    arr = np.fromiter(it, dtype=np.int32)
+    if arr.size == 0:
+        return None, None
+    highest = arr.max()
+    return int(highest), np.flatnonzero(arr == highest).tolist()
+
+
+def best_matches(a, L, word_sets=None):
     """ Find most similar string in L to a 
     Use the following methods, only proceeding to the next method if there is 
     a tie or nothing found:
     1. check for a in b
     2. check for most words from a found in b
     3. check for ordering of words
+    
+    word_sets can be given as a precomputed list of the sets of words in
+    each string in L
     """
     # 1. check for a in b
     lg.info("Matching {}".format(a))
@@ -664,8 +1019,11 @@ def best_matches(a, L):
 
     # 2. check for max words from a in b
     a = a.split(" ")
-    L = [s.split(" ") for s in L]
-    highest, matches = max_indices(count_matching_words(a, b) for b in L)
+    if word_sets is None:
+        word_sets = [frozenset(b.split(" ")) for b in L]
+    a_counts = Counter(a)
+    highest, matches = max_int_indices(count_matching_words(a_counts, b)
+                                       for b in word_sets)
     lg.info("Matches by max words: max {} matches {}".format(highest, matches[:50]))
     if highest == 0:
         return []       # Nothing contains any matching words
@@ -673,14 +1031,17 @@ def best_matches(a, L):
         return matches   # no match or one unique match    
     
     # Multiple matches so check similarity
-    highest, doubly_matched = max_indices(matchingness(a, L[i]) for i in matches)
+    highest, doubly_matched = max_indices(matchingness(a, L[i].split(" "))
+                                          for i in matches)
     matches = [matches[i] for i in doubly_matched]
     lg.info("Matches by similarity: max {} matches {}".format(highest, matches[:50]))
     return matches
 
 
-def count_matching_words(a, b):
-    return sum((word in b) for word in a)
+def count_matching_words(a_counts, b):
+    """ Number of words from a found in the set of words b, where a_counts
+    is a Counter of the words in a (so repeated words count more than once) """
+    return sum(a_counts[word] for word in a_counts.keys() & b)
 
     
 def matchingness(a, b):
@@ -718,68 +1079,219 @@ def longest_matched_sequence(a, b):
     """ Finds longest sequence in a also found in b
     Returns the starting index of the sequence in a and the starting index
     for the same sequence in b. In case of ties it will return
-    the first found in a and its first occurrence in b. """
-    for length in range(len(a), 0, -1):
-        for start_a in range(len(a) - length + 1):
-            for start_b in range(len(b) - length + 1):
-                if a[start_a:start_a+length] == b[start_b:start_b+length]:
-                    return start_a, start_b, length
-    return None
+    the first found in a and its first occurrence in b.
+
+    Uses the standard longest common substring dynamic programming table,
+    keeping only the previous row: prev[j+1] is the length of the common
+    sequence ending at a[i-1] and b[j]. """
+    longest, end_a, end_b = 0, 0, 0
+    prev = [0] * (len(b) + 1)
+    for i, x in enumerate(a):
+        curr = [0] * (len(b) + 1)
+        for j, y in enumerate(b):
+            if x == y:
+                length = curr[j+1] = prev[j] + 1
+                if length > longest:
+                    longest, end_a, end_b = length, i + 1, j + 1
+        prev = curr
+    if longest == 0:
+        return None
+    return end_a - longest, end_b - longest, longest
+
+
+MAX_VECTORISED_PARTS = 8
+
+
+def part_matrix(all_parts, part_index):
+    """ Matrix with one column per key giving the position of each of its 
+    parts in part_index, padded with -1. Returns None if numpy is not 
+    available. """
+    try:
+        import numpy as np
+    except ImportError:
+        return None
+    positions = {part: n for n, part in enumerate(part_index)}
+    matrix = np.full((max(map(len, all_parts)), len(all_parts)), -1, 
+                     dtype=np.int32)
+    for column, parts in zip(matrix.T, all_parts):
+        column[:len(parts)] = [positions[part] for part in parts]
+    return matrix
+
+
+def loose_match_rows(containing, part_index, part_matrix):
+    """ Vectorised version of loose_key_match for all keys at once, given
+    the set of key parts containing each search part. Returns the columns
+    of part_matrix (i.e. the keys) that match.
+    
+    By Hall's theorem, each search part can be assigned a different key part
+    if and only if every group of search parts is found in at least as many
+    key parts as there are search parts in the group. """
+    import numpy as np
+    # found[j, n] is whether search part j is in the nth part of part_index;
+    # the final column is for the -1 padding in part_matrix
+    found = np.zeros((len(containing), len(part_index) + 1), dtype=bool)
+    for row, parts in zip(found, containing):
+        row[:-1] = np.fromiter((part in parts for part in part_index), 
+                               dtype=bool, count=len(part_index))
+    contains = found[:, part_matrix]    # search part x key part x key
+    keys = np.flatnonzero(contains.any(axis=1).all(axis=0))
+    contains = contains[:, :, keys]
+    for group in range(1, 1 << len(containing)):
+        members = [j for j in range(len(containing)) if group >> j & 1]
+        if len(members) > 1:
+            covered = contains[members].any(axis=0).sum(axis=0)
+            keep = covered >= len(members)
+            keys, contains = keys[keep], contains[:, :, keep]
+    return keys
+
+
+def parts_containing(s, part_index, gram_index):
+    """ The set of distinct key parts (the keys of part_index) that contain 
+    s, checking only the parts that contain all of its character pairs """
+    parts = index_intersection(gram_index, grams(s))
+    if parts is None:
+        parts = part_index
+    return {k for k in parts if s in k}
+
+
+def grams(s):
+    """ The set of pairs of adjacent characters in s, or the character itself
+    if s is a single character. Any string containing s must contain all 
+    of these. """
+    if len(s) == 1:
+        return {s}
+    return {s[i:i+2] for i in range(len(s) - 1)}
+
+
+def index_intersection(index, items):
+    """ The set of positions found in the index (a dict of sets) for all 
+    of the items, or None if there are no items to narrow it down """
+    r = None
+    for item in items:
+        found = index.get(item, set())
+        r = found if r is None else r & found
+        if not r:
+            break
+    return r
 
 
-def loose_key_match(search_parts, key_parts):
+def loose_key_match(search_parts, key_parts, containing=None):
     """ Test whether a list of search strings e.g. ["rofst", "f"] matches a key
     such as ["rofst_phh", "gpia", "3", "q2", "urb"], with a loose algorithm that includes
     cases where the parts of the search string are found within the parts of
-    the key. """
-    # First, quick test of whether all parts are found
-    if any(not any(s in k for k in key_parts) for s in search_parts):
+    the key. Each part of the key can only be used once. 
+    containing can be given as the precomputed set of key parts that contain
+    each search part. """
+    # For each search part, a bitmask of the key parts that contain it
+    if containing is None:
+        masks = [sum(1 << j for j, k in enumerate(key_parts) if s in k)
+                 for s in search_parts]
+    else:
+        masks = [sum(1 << j for j, k in enumerate(key_parts) if k in c)
+                 for c in containing]
+    
+    # Quick tests: all parts are found, and enough different key parts 
+    # are involved
+    if not all(masks):
+        return False
+    if bin(reduce(or_, masks, 0)).count("1") < len(masks):
         return False
     
-    # Then slower test of whether the parts are found in a specific permutation
-    for permutation in permutations(key_parts, len(search_parts)):
-        if all(s in k for s, k in zip(search_parts, permutation)):
+    # Then check each search part can be assigned to a different key part
+    return has_complete_matching(tuple(masks))
+
+
+def has_complete_matching(masks):
+    """ Whether each item i can be assigned a different one of the
+    bits set in masks[i] (backtracking, memoized on the bits used so far) """
+    @lru_cache(maxsize=None)
+    def can_match(i, used):
+        if i == len(masks):
             return True
-    return False
+        available = masks[i] & ~used
+        while available:
+            bit = available & -available    # lowest set bit
+            if can_match(i + 1, used | bit):
+                return True
+            available ^= bit
+        return False
+    
+    return can_match(0, 0)
 
 
 def strict_key_match(search_parts, key_parts):
     """ Test whether a list of search strings e.g. ["rofst", "f"] matches a key
     such as ["rofst_phh", "gpia", "3", "q2", "urb"], with a stricter algorithm that includes
     only cases where the parts of the search string match exactly parts of
-    the key. """
-    if any((s not in key_parts) for s in search_parts):
-        return False
-    
-    return tuple(search_parts) in permutations(key_parts, len(search_parts))
+    the key (including repeated parts). """
+    unique = set(search_parts)
+    if len(unique) == len(search_parts):    # usual case: no repeated parts
+        return unique.issubset(key_parts)
+    return not Counter(search_parts) - Counter(key_parts)
 
 
-def get_root(short_key, all_short_keys):
-    for ancestor in get_relations(short_key, all_short_keys, is_ancestor):
-        if not has_ancestor(ancestor, all_short_keys):
+def get_root(short_key, all_short_keys, all_masks=None):
+    """ all_masks can be given as the precomputed short_key_mask of each
+    of the short keys """
+    if all_masks is None:
+        all_masks = [short_key_mask(k) for k in all_short_keys]
+    for ancestor in get_relations(short_key, all_short_keys, is_ancestor_mask,
+                                  all_parts=all_masks, encode=short_key_mask):
+        if not has_ancestor(ancestor, all_short_keys, all_masks):
             return ancestor
 
     
-def has_ancestor(short_key, all_short_keys):
+def has_ancestor(short_key, all_short_keys, all_masks=None):
+    if all_masks is None:
+        all_masks = [short_key_mask(k) for k in all_short_keys]
     return any(True 
-               for _ in get_relations(short_key, all_short_keys, is_ancestor))
+               for _ in get_relations(short_key, all_short_keys, is_ancestor_mask,
+                                      all_parts=all_masks, encode=short_key_mask))
+    
     
+def get_relations(short_key, all_short_keys, relation, reverse=False,
+                  all_parts=None, encode=None):
+    """ Get all indicator short keys for which the relation function is True
+    all_parts can be given as the precomputed parts of each of the
+    short keys, to avoid splitting them all again on every call.
     
-def get_relations(short_key, all_short_keys, relation, reverse=False):
-    """ Get all indicator short keys for which the relation function is True """
-    me = short_key.split("-")
+    By default the relation compares tuples of parts. An alternative
+    encoding of the short keys (e.g. short_key_mask) can be used by passing
+    the encode function and a relation that compares the encoded keys;
+    all_parts must then use the same encoding. """
+    if encode is None:
+        encode = lambda k: tuple(k.split("-"))
+    if all_parts is None:
+        all_parts = [encode(k) for k in all_short_keys]
+    me = encode(short_key)
     predicate = relation
     if reverse:
         predicate = lambda a, b: relation(b, a)
-    for other in all_short_keys:
-        if predicate(other.split("-"), me):
+    for other, other_parts in zip(all_short_keys, all_parts):
+        if predicate(other_parts, me):
             yield other
+
+
+# Bit number assigned to each short key part seen so far
+_PART_BITS = {}
+
+
+def short_key_mask(short_key):
+    """ Encode a short key as a tuple of (bit number of its first part, 
+    bitmask of all of its parts). Subset tests between short keys then become
+    integer operations. Bit numbers are assigned to new parts as they are
+    seen, and are shared by all keys. """
+    parts = short_key.split("-")
+    mask = 0
+    for part in parts:
+        mask |= 1 << _PART_BITS.setdefault(part, len(_PART_BITS))
+    return _PART_BITS[parts[0]], mask
                 
             
 def is_ancestor(a, b):
     """ Whether a is an ancestor of b, i.e. by disaggregating a one or more
     times you get b.
-    Both a and b are represented as lists of parts of the short key.
+    Both a and b are represented as lists or tuples of parts of the short key.
     Note, this assumes there are no duplicate parts in short keys, which 
     is the case for the current UIS set. """
     return a[0] == b[0] and set(b) > set(a)
@@ -789,12 +1301,28 @@ def is_ancestor(a, b):
 def is_parent(a, b):
     """ Whether a is a parent of b, i.e. by disaggregating a once you get b. """
     return is_ancestor(a, b) and len(set(b) - set(a)) == 1
+
+
+def is_ancestor_mask(a, b):
+    """ As is_ancestor, with a and b encoded by short_key_mask """
+    return a[0] == b[0] and a[1] & b[1] == a[1] and a[1] != b[1]
+
+
+def is_parent_mask(a, b):
+    """ As is_parent, with a and b encoded by short_key_mask """
+    extra = b[1] & ~a[1]
+    return is_ancestor_mask(a, b) and extra & (extra - 1) == 0
+
+
+# Equivalent relations for short keys encoded with short_key_mask
+MASK_RELATIONS = {is_ancestor: is_ancestor_mask, is_parent: is_parent_mask}
   
     
 def specs_match(incomplete_spec, indicator):
     """ Whether incomplete spec is a potential match for an indicator """
     for k, v in incomplete_spec.items():
-        if v not in [None, "", indicator[k]]:
+        value = indicator[k]
+        if v is not None and v != "" and v != value:
             return False
     return True
 
@@ -806,13 +1334,33 @@ def latest_by_country(df):
     data.
     """    
     group = ["Indicator key", "REF_AREA"]
-    df = df.sort_values(by="TIME_PERIOD").groupby(group, as_index=False).last()
+    df = (df.sort_values(by=group + ["TIME_PERIOD"])
+            .drop_duplicates(subset=group, keep="last")
+            .reset_index(drop=True))
     df["Country"] = formatted_column(df, "{UN country name} ({Year})")
     return df
     
 def formatted_column(dataframe, format_string):
     """ Create a new string column using the format template and the other 
         columns in each row
+        
+        Templates that only contain plain column names, e.g. 
+        "{UN country name} ({Year})", are built by joining whole columns.
+        Others (with format specs, conversions, indexing etc.) are formatted
+        row by row.
     """
-    return dataframe.apply(lambda r: format_string.format(**r), axis=1)
+    parsed = list(string.Formatter().parse(format_string))
+    if any(spec or conversion or 
+           (field is not None and field not in dataframe.columns)
+           for _, field, spec, conversion in parsed):
+        return dataframe.apply(lambda r: format_string.format(**r), axis=1)
+    r = ""
+    for literal, field, _, _ in parsed:
+        r = r + literal
+        if field is not None:
+            # Missing values are shown as "nan", as str.format does
+            r = r + dataframe[field].astype(str).fillna("nan")
+    if isinstance(r, str):    # no fields in the template
+        return dataframe.apply(lambda _: r, axis=1)
+    return r
     
\ No newline at end of file
@@ -42,6 +42,12 @@ print(out_of_school["metadata"]["indicators"])      # Indicator metadata
 latest = uis.latest_by_country(response.dataframe)
 print(latest[latest["REF_AREA"] == "TZ"][["Year", "SEX", "Value"]])
 
+# 4c. Send one query per country at the same time, reusing the connection
+responses = api.query_many([{"ind": "ROFST.1.cp", "country": c} 
+                            for c in ["TZ", "KE", "UG"]])
+for response in responses:
+    print(uis.latest_by_country(response.dataframe)[["REF_AREA", "Year", "Value"]])
+
 # 5. Use fuzzy lookup to explore what indicators are available
 I = uis.Indicator
 print(I.fuzzy_lookup("out of school"))  # get the main indicators on rate of out of school